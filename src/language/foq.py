@@ -37,52 +37,28 @@ The query is generated by the following steps:
 """
 
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import accumulate, chain, groupby
 import json
-from typing import Dict, List
+import sys
+from typing import Dict, List, Tuple
 from random import sample
 
+import numpy as np
 import torch
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from src.language.tnorm import Tnorm
 from src.structure.neural_binary_predicate import NeuralBinaryPredicate
 # from src.utils.data import RaggexxdBatch
 
 
-def check_ldict(ldict):
-    """
-    Ldict is a nested dict that stores the GROUNDED information
-    """
-    assert 'op' in ldict
-    op = ldict['op']
-    assert 'args' in ldict
-    args = ldict['args']
-
-    if op == Term.op:
-        assert 'name' in args
-        assert 'state' in args
-        assert 'entity_id_list' in args
-    if op == Atomic.op:
-        assert 'name' in args
-        assert 'relation_id_list' in args
-        check_ldict(args['term1'])
-        check_ldict(args['term2'])
-    if op == Negation.op:
-        assert 'formula' in args
-        check_ldict(args['formula'])
-    if op == Conjunction.op or op == Disjunction.op:
-        assert 'formulas' in args
-        for f in args['formulas']:
-            check_ldict(f)
-
-
-def get_ldict(op, **args):
-    ans = {'op': op, 'args': args}
-    check_ldict(ans)
-    return ans
-
-
 class Lobject:
+    # op is a class attribute, so it does not take a slot
+    __slots__ = ()
     op = "default"
 
     @abstractmethod
@@ -94,8 +70,10 @@ class Lobject:
         pass
 
     def __repr__(self):
-        check_ldict(self.to_ldict())
-        return json.dumps(self.to_ldict(), indent=1)
+        if orjson is not None:
+            return orjson.dumps(self.to_ldict(),
+                                option=orjson.OPT_INDENT_2).decode()
+        return json.dumps(self.to_ldict(), indent=2)
 
 
 
@@ -108,11 +86,14 @@ class Term(Lobject):
 
     op = "term"
 
+    __slots__ = ('state', 'name', 'parent_predicate', 'entity_id_list')
+
     def __init__(self, state, name):
         self.state = state
-        self.name = name
+        self.name = sys.intern(name)
         self.parent_predicate = None
-        # no data is stored in the term
+        # only the entity given in the lstr is stored in the term
+        self.entity_id_list = []
 
     @classmethod
     def parse(cls, ldict):
@@ -122,7 +103,7 @@ class Term(Lobject):
         name = args['name']
         state = args['state']
         object = cls(name=name, state=state)
-        object.entity_id_list = args['entity_id_list']
+        object.entity_id_list = list(args['entity_id_list'])
         return object
 
     def to_ldict(self):
@@ -159,25 +140,25 @@ class Term(Lobject):
 
 
 class Formula(Lobject):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__()
 
     @staticmethod
     def parse(ldict):
-        op = ldict['op']
-        if op == Atomic.op:
-            return Atomic.parse(ldict)
-        elif op == Negation.op:
-            return Negation.parse(ldict)
-        elif op == Conjunction.op:
-            return Conjunction.parse(ldict)
-        elif op == Disjunction.op:
-            return Disjunction.parse(ldict)
-        else:
+        cls = _OP_TABLE.get(ldict['op'])
+        if cls is None:
             raise NotImplementedError("Unsupported Operator")
+        return cls.parse(ldict)
 
     @abstractmethod
     def get_atomics(self) -> Dict[str, 'Atomic']:
+        """
+        The connective nodes cache the result since formulas are not modified
+        after they are constructed, an atomic builds its one-entry dict on
+        each call
+        """
         pass
 
     @property
@@ -188,20 +169,24 @@ class Formula(Lobject):
 class Atomic(Formula):
     op = 'pred'
 
+    __slots__ = ('relation', 'head', 'tail', 'negated', 'relation_id_list',
+                 'skolem_negation', '_lstr')
+
     def __init__(self,
                  relation: str,
                  head: Term,
                  tail: Term) -> None:
-        self.relation = relation
+        self.relation = sys.intern(relation)
         self.head = head
         self.tail = tail
-        # no data is stored in the atomic
-        # self.relation_id_list = []
+        # only the relation given in the lstr is stored in the atomic
+        self.relation_id_list = []
         # indicates whether there is a negator associated to this atomic
         self.negated = False
+        self._lstr = None
 
     @classmethod
-    def parse(cls, ldict):
+    def parse(cls, ldict, negated=False):
         op = ldict['op']
         assert op == cls.op
         args = ldict['args']
@@ -209,8 +194,11 @@ class Atomic(Formula):
         name = args['name']  # name indicates the name of relation
         head = Term.parse(args['head'])
         tail = Term.parse(args['tail'])
-        obj = cls(name=name, head=head, tail=tail)
-        obj.relation_id_list = args['relation_id_list']
+        obj = cls(relation=name, head=head, tail=tail)
+        obj.relation_id_list = list(args['relation_id_list'])
+        if negated:
+            obj.negated = True
+            obj.skolem_negation = True
         head.parent_predicate = obj
         tail.parent_predicate = obj
         return obj
@@ -219,7 +207,7 @@ class Atomic(Formula):
         obj = {
             'op': self.op,
             'args': {
-                'name': self.name,
+                'name': self.relation,
                 'relation_id_list': self.relation_id_list,
                 'head': self.head.to_ldict(),
                 'tail': self.tail.to_ldict()
@@ -229,12 +217,16 @@ class Atomic(Formula):
 
     @property
     def lstr(self):
-        lstr = f"{self.relation}({self.head.name},{self.tail.name})"
-        return lstr
+        if self._lstr is None:
+            # interned since it is the key of the atomic dicts
+            self._lstr = sys.intern("".join([self.relation, "(",
+                                             self.head.name, ",",
+                                             self.tail.name, ")"]))
+        return self._lstr
 
     def get_atomics(self) -> Dict[str, 'Atomic']:
-        ans = {self.lstr: self}
-        return ans
+        # not cached, it would make the atomic refer to itself
+        return {self.lstr: self}
 
     def get_terms(self):
         return [self.head, self.tail]
@@ -245,23 +237,29 @@ class Atomic(Formula):
 
 
 class Connective(Formula):
-    pass
+    __slots__ = ()
 
 
 class Negation(Connective):
     op = 'neg'
 
+    __slots__ = ('formula', '_atomics_cache', '_num_atomics', '_lstr')
+
     def __init__(self, formula: Formula) -> None:
         self.formula = formula
+        self._atomics_cache = None
+        self._lstr = None
+        self._num_atomics = None
 
     @classmethod
     def parse(cls, ldict):
         op = ldict['op']
         assert op == cls.op
         args = ldict['args']
-        formula = Formula.parse(args['formula'])
-        if formula.op == 'pred':
-            formula.skolem_negation = True
+        if args['formula']['op'] == Atomic.op:
+            formula = Atomic.parse(args['formula'], negated=True)
+        else:
+            formula = Formula.parse(args['formula'])
         return cls(formula)
 
     def to_ldict(self):
@@ -273,24 +271,32 @@ class Negation(Connective):
 
     @property
     def lstr(self) -> str:
-        lstr = f"!({self.formula.lstr})"
-        return lstr
+        if self._lstr is None:
+            self._lstr = "".join(["!(", self.formula.lstr, ")"])
+        return self._lstr
 
     def get_atomics(self) -> Dict[str, 'Atomic']:
-        ans = {}
-        ans.update(self.formula.get_atomics())
-        return ans
+        if self._atomics_cache is None:
+            self._atomics_cache = dict(self.formula.get_atomics())
+        return self._atomics_cache
 
     @property
     def num_atomics(self):
-        return self.formula.num_atomics
+        if self._num_atomics is None:
+            self._num_atomics = self.formula.num_atomics
+        return self._num_atomics
 
 
 class Conjunction(Connective):
     op = 'conj'
 
+    __slots__ = ('formulas', '_atomics_cache', '_num_atomics', '_lstr')
+
     def __init__(self, formulas: List[Formula]) -> None:
         self.formulas = formulas
+        self._atomics_cache = None
+        self._lstr = None
+        self._num_atomics = None
 
     @classmethod
     def parse(cls, ldict):
@@ -311,25 +317,37 @@ class Conjunction(Connective):
 
     @property
     def lstr(self):
-        lstr = "&".join(f"({f.lstr})" for f in self.formulas)
-        return lstr
+        if self._lstr is None:
+            self._lstr = "".join(
+                ["(", ")&(".join([f.lstr for f in self.formulas]), ")"])
+        return self._lstr
 
     def get_atomics(self) -> Dict[str, 'Atomic']:
-        ans = {}
-        for f in self.formulas:
-            ans.update(f.get_atomics())
-        return ans
+        if self._atomics_cache is None:
+            ans = {}
+            for f in self.formulas:
+                ans.update(f.get_atomics())
+            self._atomics_cache = ans
+        return self._atomics_cache
 
     @property
     def num_atomics(self):
-        return sum([formula.num_atomics for formula in self.formulas])
+        if self._num_atomics is None:
+            self._num_atomics = sum(
+                formula.num_atomics for formula in self.formulas)
+        return self._num_atomics
 
 
 class Disjunction(Connective):
     op = 'disj'
 
+    __slots__ = ('formulas', '_atomics_cache', '_num_atomics', '_lstr')
+
     def __init__(self, formulas: List[Formula]) -> None:
         self.formulas = formulas
+        self._atomics_cache = None
+        self._lstr = None
+        self._num_atomics = None
 
     @classmethod
     def parse(cls, ldict):
@@ -350,18 +368,74 @@ class Disjunction(Connective):
 
     @property
     def lstr(self):
-        lstr = "|".join(f"({f.lstr})" for f in self.formulas)
-        return lstr
+        if self._lstr is None:
+            self._lstr = "".join(
+                ["(", ")|(".join([f.lstr for f in self.formulas]), ")"])
+        return self._lstr
 
     def get_atomics(self) -> Dict[str, 'Atomic']:
-        ans = {}
-        for f in self.formulas:
-            ans.update(f.get_atomics())
-        return ans
+        if self._atomics_cache is None:
+            ans = {}
+            for f in self.formulas:
+                ans.update(f.get_atomics())
+            self._atomics_cache = ans
+        return self._atomics_cache
 
     @property
     def num_atomics(self):
-        return sum([formula.num_atomics for formula in self.formulas])
+        if self._num_atomics is None:
+            self._num_atomics = sum(
+                formula.num_atomics for formula in self.formulas)
+        return self._num_atomics
+
+
+_OP_TABLE = {Atomic.op: Atomic,
+             Negation.op: Negation,
+             Conjunction.op: Conjunction,
+             Disjunction.op: Disjunction}
+
+
+# BFS orderings of the query shapes seen so far, see EFO1Query._shape_key
+_BFS_ORDERING_CACHE = {}
+
+
+class RaggedAnswerTensor:
+    """
+    The answers of a variable over the instances stored in one flat tensor
+    the answers of the i-th instance are
+        self.flatten[self.offsets[i]: self.offsets[i+1]]
+    the capacity of self.flatten is doubled when it is full
+    the answers are stored as int64, so the views index the rankings as is
+    """
+    def __init__(self, capacity=1024, dtype=torch.long):
+        self.flatten = torch.empty(capacity, dtype=dtype)
+        self.offsets = [0]
+
+    def extend(self, answers_list):
+        """
+        Append the answers of several instances with a single conversion
+        """
+        begin = self.offsets[-1]
+        sizes = [len(answers) for answers in answers_list]
+        end = begin + sum(sizes)
+        if end > len(self.flatten):
+            extra = max(len(self.flatten), end - len(self.flatten))
+            self.flatten = torch.cat(
+                [self.flatten,
+                 torch.empty(extra, dtype=self.flatten.dtype)])
+        self.flatten[begin: end] = torch.tensor(
+            list(chain.from_iterable(answers_list)), dtype=self.flatten.dtype)
+        self.offsets.extend(list(accumulate(sizes, initial=begin))[1:])
+
+    def size(self, i):
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        # a view, no data is copied
+        return self.flatten[self.offsets[i]: self.offsets[i + 1]]
 
 
 class EFO1Query:
@@ -383,10 +457,16 @@ class EFO1Query:
 
 
     each answer is a dict whose keys are the variable and values are the list of possible answers
+
+    self.answer_tensor_dict stores the answers of each free variable in
+        RaggedAnswerTensor by 'easy' and 'hard' when answer_tensor is set,
+        the answer lists are left empty in this case and the noisy answers
+        are dropped, since only the evaluation sets it
     """
 
     def __init__(self,
-                 formula: Formula) -> None:
+                 formula: Formula,
+                 answer_tensor: bool = False) -> None:
         self.formula: Formula = formula
         self.easy_answer_list = []
         self.hard_answer_list = []
@@ -400,33 +480,119 @@ class EFO1Query:
         self.term_dict: Dict[str, Term] = {}
         self.term_grounded_entity_id_dict: Dict[str, List] = {}
 
-        self.term_name2atomic_name_list: Dict[str, str] = defaultdict(list)
+        self.term_name2atomic_name_list: Dict[str, Tuple[str, ...]] = {}
+
+        # number of the grounded rows written after reserve is called
+        self._cursor = None
+        self._capacity = None
 
         # run initialization
         self._init_query()
 
+        self.answer_tensor_dict = None
+        self._num_tensor_instances = 0
+        if answer_tensor:
+            self.answer_tensor_dict = {
+                kind: {name: RaggedAnswerTensor()
+                       for name in self.free_variable_dict}
+                for kind in ('easy', 'hard')}
+
     def _init_query(self):
-        # handle predicates and relations
         self.atomic_dict = self.formula.get_atomics()
         self.pred_grounded_relation_id_dict = {}
-        for alstr, atomic in self.atomic_dict.items():
-            rel_name = atomic.relation
-            self.pred_grounded_relation_id_dict[rel_name] = []
-
-        # handle terms
         self.term_dict = {}
-        for alstr, atomic in self.atomic_dict.items():
-            for t in atomic.get_terms():
+        self.term_grounded_entity_id_dict = {}
+
+        # partition the terms by their states
+        self._free_dict = {}
+        self._universal_dict = {}
+        self._existential_dict = {}
+        self._symbol_dict = {}
+        state2dict = {Term.FREE: self._free_dict,
+                      Term.UNIVERSAL: self._universal_dict,
+                      Term.EXISTENTIAL: self._existential_dict,
+                      Term.SYMBOL: self._symbol_dict}
+
+        # integer indexed copy of the term graph for the BFS ordering
+        # the i-th term of term_dict has the term id i
+        # the i-th atomic of atomic_dict has the atomic id i
+        self._term_id: Dict[str, int] = {}
+        self._term_is_symbol: List[bool] = []
+        self._atomic_term_ids: List[Tuple[int, int]] = []
+        self._adj: List[List[int]] = []
+
+        # handle predicates, relations and terms in a single pass
+        term_name2atomic_name_list = defaultdict(list)
+        for atomic_id, (alstr, atomic) in enumerate(self.atomic_dict.items()):
+            self.pred_grounded_relation_id_dict.setdefault(
+                atomic.relation, [])
+            head, tail = atomic.head, atomic.tail
+            for t in (head, tail):
                 self.term_dict[t.name] = t
-        for name, term in self.term_dict.items():
-            self.term_grounded_entity_id_dict[name] = []
-
-        for alstr, atomic in self.atomic_dict.items():
-            head, tail = atomic.get_terms()
-            self.term_name2atomic_name_list[head.name].append(alstr)
-            self.term_name2atomic_name_list[tail.name].append(alstr)
+                self.term_grounded_entity_id_dict[t.name] = []
+                if t.state in state2dict:
+                    state2dict[t.state][t.name] = t
+                if t.name not in self._term_id:
+                    self._term_id[t.name] = len(self._term_is_symbol)
+                    self._term_is_symbol.append(t.state == Term.SYMBOL)
+                    self._adj.append([])
+            term_name2atomic_name_list[head.name].append(alstr)
+            term_name2atomic_name_list[tail.name].append(alstr)
+
+            head_id = self._term_id[head.name]
+            tail_id = self._term_id[tail.name]
+            self._atomic_term_ids.append((head_id, tail_id))
+            self._adj[head_id].append(atomic_id)
+            if tail_id != head_id:
+                self._adj[tail_id].append(atomic_id)
+
+        # a self-loop atomic is appended twice, dict.fromkeys keeps the order
+        self.term_name2atomic_name_list = {
+            k: tuple(dict.fromkeys(v))
+            for k, v in term_name2atomic_name_list.items()}
+
+        # the term graph without the relation names and grounded ids,
+        # the queries of the same type share it
+        self._shape_key = (tuple(self._term_id),
+                           tuple(self._term_is_symbol),
+                           tuple(self._atomic_term_ids))
+
+    def reserve(self, n_instances):
+        """
+        Preallocate the grounded ids of the symbols and relations as numpy
+        columns of n_instances rows, the i-th instance is the i-th row
+        It should be called before any instance is appended, and only the
+        symbols and relations can be appended after it, one id per key
+        """
+        assert not any(len(v) for v in
+                       self.term_grounded_entity_id_dict.values())
+        assert not any(len(v) for v in
+                       self.pred_grounded_relation_id_dict.values())
+        for name in self.symbol_dict:
+            self.term_grounded_entity_id_dict[name] = np.empty(
+                n_instances, dtype=np.int64)
+        for name in self.pred_grounded_relation_id_dict:
+            self.pred_grounded_relation_id_dict[name] = np.empty(
+                n_instances, dtype=np.int64)
+        self._cursor = 0
+        self._capacity = n_instances
 
     def append_relation_and_symbols(self, append_dict):
+        if self._cursor is not None:
+            assert self._cursor < self._capacity, \
+                f"more than the {self._capacity} reserved instances appended"
+            for k, v in append_dict.items():
+                assert np.ndim(v) == 0, \
+                    f"the reserved column of {k} takes one id per instance"
+                if k in self.term_dict:
+                    assert k in self.symbol_dict, \
+                        f"only the symbols are reserved, {k} is not a symbol"
+                    self.term_grounded_entity_id_dict[k][self._cursor] = v
+                else:
+                    self.pred_grounded_relation_id_dict[k][self._cursor] = v
+            self._cursor += 1
+            return
+
         for k, v in append_dict.items():
             if k in self.term_dict:
                 self.term_grounded_entity_id_dict[k].append(v)
@@ -439,45 +605,82 @@ class EFO1Query:
                             hard_answers=[],
                             noisy_answer=[]):
         self.append_relation_and_symbols(append_dict)
+        if self.answer_tensor_dict is not None:
+            self._extend_answer_tensors([easy_answers], [hard_answers])
+            return
         self.easy_answer_list.append(easy_answers)
         self.hard_answer_list.append(hard_answers)
         self.noisy_answer_list.append(noisy_answer)
 
+    def extend_qa_instances(self, batch_input):
+        """
+        Append the (append_dict, easy_answers, hard_answers) instances,
+        the answer tensors are extended once for the whole batch
+        """
+        if self.answer_tensor_dict is None:
+            for append_dict, easy_answers, hard_answers in batch_input:
+                self.append_qa_instances(
+                    append_dict, easy_answers, hard_answers)
+            return
+        for append_dict, _, _ in batch_input:
+            self.append_relation_and_symbols(append_dict)
+        self._extend_answer_tensors([b[1] for b in batch_input],
+                                    [b[2] for b in batch_input])
+
+    def _extend_answer_tensors(self, easy_answers_list, hard_answers_list):
+        for kind, answers_list in (('easy', easy_answers_list),
+                                   ('hard', hard_answers_list)):
+            for name, answer_tensor in self.answer_tensor_dict[kind].items():
+                # the answers can be an empty list instead of a dict
+                answer_tensor.extend(
+                    [answers.get(name, []) if isinstance(answers, dict)
+                     else [] for answers in answers_list])
+        self._num_tensor_instances += len(easy_answers_list)
+
+    def get_answer_tensor(self, kind, i, key='f'):
+        """
+        The answers of the variable key in the i-th instance as a tensor view
+        kind is one of 'easy' and 'hard'
+        """
+        return self.answer_tensor_dict[kind][key][i]
+
+    def has_answer_tensor(self, kind, i, key='f'):
+        return self.answer_tensor_dict[kind][key].size(i) > 0
+
     def has_term_grounded_entity_id_list(self, key):
-        return len(self.term_grounded_entity_id_dict[key]) > 0
+        return len(self.get_term_grounded_entity_id_list(key)) > 0
 
     def get_term_grounded_entity_id_list(self, key):
-        return self.term_grounded_entity_id_dict[key]
+        ids = self.term_grounded_entity_id_dict[key]
+        if self._cursor is not None:
+            # only the rows written so far
+            ids = ids[:self._cursor]
+        return ids
 
     def has_pred_grounded_relation_id_list(self, key):
-        return len(self.pred_grounded_relation_id_dict[key]) > 0
+        return len(self.get_pred_grounded_relation_id_list(key)) > 0
 
     def get_pred_grounded_relation_id_list(self, key):
-        return self.pred_grounded_relation_id_dict[key]
+        ids = self.pred_grounded_relation_id_dict[key]
+        if self._cursor is not None:
+            ids = ids[:self._cursor]
+        return ids
 
     @property
     def free_variable_dict(self):
-        return {k: v
-                for k, v in self.term_dict.items()
-                if v.state == Term.FREE}
+        return self._free_dict
 
     @property
     def universal_variable_dict(self):
-        return {k: v
-                for k, v in self.term_dict.items()
-                if v.state == Term.UNIVERSAL}
+        return self._universal_dict
 
     @property
     def existential_variable_dict(self):
-        return {k: v
-                for k, v in self.term_dict.items()
-                if v.state == Term.EXISTENTIAL}
+        return self._existential_dict
 
     @property
     def symbol_dict(self):
-        return {k: v
-                for k, v in self.term_dict.items()
-                if v.state == Term.SYMBOL}
+        return self._symbol_dict
 
     @property
     def is_sentence(self):
@@ -485,8 +688,7 @@ class EFO1Query:
         Determine the state of the formula
         A formula is sentence when all variables are quantified
         """
-        return len({k: v for k, v in self.term_dict.items()
-                    if v.state == Term.FREE}) == 0
+        return not self._free_dict
 
     @property
     def lstr(self):
@@ -494,8 +696,21 @@ class EFO1Query:
 
     @property
     def num_instances(self):
-        num_instances = len(self.easy_answer_list)
-        assert num_instances == len(self.hard_answer_list)
+        if self.answer_tensor_dict is not None:
+            return self._num_tensor_instances
+        return len(self.easy_answer_list)
+
+    def validate_num_instances(self):
+        """
+        Check that every grounded list holds one entry per instance
+        """
+        num_instances = self.num_instances
+        if self.answer_tensor_dict is None:
+            assert num_instances == len(self.hard_answer_list)
+        else:
+            for answer_tensors in self.answer_tensor_dict.values():
+                for answer_tensor in answer_tensors.values():
+                    assert num_instances == len(answer_tensor)
         for k in self.symbol_dict:
             assert num_instances == len(
                 self.get_term_grounded_entity_id_list(k))
@@ -505,7 +720,7 @@ class EFO1Query:
             assert num_instances == len(
                 self.get_pred_grounded_relation_id_list(pred_name))
 
-        return len(self.easy_answer_list)
+        return num_instances
 
     @property
     def num_predicates(self):
@@ -518,39 +733,64 @@ class EFO1Query:
                + len(self.free_variable_dict)
 
     def get_all_gounded_ids(self):
-        entity_ids = []
-        for term_name in self.term_grounded_entity_id_dict:
-            entity_ids += self.term_grounded_entity_id_dict[term_name]
-        relation_ids = []
-        for pred_name in self.pred_grounded_relation_id_dict:
-            relation_ids += self.pred_grounded_relation_id_dict[pred_name]
+        # the reserved numpy columns are turned into python ints
+        entity_ids = list(chain.from_iterable(
+            self._as_list(self.get_term_grounded_entity_id_list(k))
+            for k in self.term_grounded_entity_id_dict))
+        relation_ids = list(chain.from_iterable(
+            self._as_list(self.get_pred_grounded_relation_id_list(k))
+            for k in self.pred_grounded_relation_id_dict))
         return entity_ids, relation_ids
 
+    @staticmethod
+    def _as_list(ids):
+        if isinstance(ids, np.ndarray):
+            return ids.tolist()
+        return ids
+
     def get_bfs_variable_ordering(self, source_var_name='f'):
         """
         get variable ordering by a topological sort
+        each level collects the unvisited neighbors of all the variables in
+        the previous level
+        the ordering only depends on the query shape, so it is searched once
+        per shape and a fresh copy is returned for the callers to consume
         """
-        visited_vars = set(source_var_name)
-        var_name_levels = [[(source_var_name, 0)]]
-        while True:
-            for var_name, order in var_name_levels[-1]:
-                next_var_name_level = []
-                for atomic_name in self.term_name2atomic_name_list[var_name]:
-                    atomic = self.atomic_dict[atomic_name]
-                    for term in atomic.get_terms():
-                        if term.state == Term.SYMBOL:
-                            continue
-
-                        if term.name not in visited_vars:
-                            visited_vars.add(term.name)
-                        else:
-                            continue
-
-                        next_var_name_level.append((term.name, order + 1))
-
-            if len(next_var_name_level) == 0:
-                break
-            else:
-                var_name_levels.append(next_var_name_level)
-
+        key = (self._shape_key, source_var_name)
+        var_name_levels = _BFS_ORDERING_CACHE.get(key)
+        if var_name_levels is None:
+            var_name_levels = tuple(
+                tuple(level) for level in
+                self._search_bfs_variable_ordering(source_var_name))
+            _BFS_ORDERING_CACHE[key] = var_name_levels
+        return [list(level) for level in var_name_levels]
+
+    def _search_bfs_variable_ordering(self, source_var_name):
+        if source_var_name not in self._term_id:
+            return [[(source_var_name, 0)]]
+
+        term_names = list(self.term_dict)
+        term_is_symbol = self._term_is_symbol
+        atomic_term_ids = self._atomic_term_ids
+        adj = self._adj
+
+        source_id = self._term_id[source_var_name]
+        visited = [False] * len(term_names)
+        visited[source_id] = True
+        # the BFS emits the variables level by level, so the levels are
+        # contiguous in the flat result
+        result = [(source_var_name, 0)]
+        frontier = deque([(source_id, 0)])
+        while frontier:
+            var_id, order = frontier.popleft()
+            for atomic_id in adj[var_id]:
+                for term_id in atomic_term_ids[atomic_id]:
+                    if term_is_symbol[term_id] or visited[term_id]:
+                        continue
+                    visited[term_id] = True
+                    result.append((term_names[term_id], order + 1))
+                    frontier.append((term_id, order + 1))
+
+        var_name_levels = [list(level) for _, level in
+                           groupby(result, key=lambda x: x[1])]
         return var_name_levels
\ No newline at end of file
@@ -87,24 +87,36 @@ def identify_top_binary_operator(lstr: str):
 def parse_lstr_to_lformula(lstr: str) -> Formula:
     """
     parse the string a.k.a, lstr to lobject
+    identical atomics, e.g., the ones repeated across the disjuncts of a DNF,
+    are parsed into the same object
+    """
+    return _parse_lstr_to_lformula(lstr, atomic_table={})
+
+
+def _parse_lstr_to_lformula(lstr: str,
+                            atomic_table: dict,
+                            negated: bool = False) -> Formula:
+    """
+    atomic_table maps the predicate and term names and negated to the
+    atomics parsed so far, negated only applies when lstr is a predicate
     """
     _lstr = remove_brackets(lstr)
 
     # identify top-level operator
     if _lstr[0] == '!':
         sub_lstr = _lstr[1:]
-        sub_formula = parse_lstr_to_lformula(sub_lstr)
+        sub_formula = _parse_lstr_to_lformula(
+            sub_lstr, atomic_table, negated=True)
         if sub_formula.op == 'pred':
-            sub_formula.negated = True
             return Negation(formula=sub_formula)
 
     binary_operator, binary_operator_index = identify_top_binary_operator(_lstr)
 
     if binary_operator_index >= 0:
         left_lstr = _lstr[:binary_operator_index]
-        left_formula = parse_lstr_to_lformula(left_lstr)
+        left_formula = _parse_lstr_to_lformula(left_lstr, atomic_table)
         right_lstr = _lstr[binary_operator_index+1:]
-        right_formula = parse_lstr_to_lformula(right_lstr)
+        right_formula = _parse_lstr_to_lformula(right_lstr, atomic_table)
         if binary_operator == '&':
             return Conjunction(formulas=[left_formula, right_formula])
         if binary_operator == '|':
@@ -115,6 +127,11 @@ def parse_lstr_to_lformula(lstr: str) -> Formula:
         right_lstr = right_lstr[:-1]
         term1_name, term2_name = right_lstr.split(',')
 
+        # the numeric ids are given by the names
+        key = (predicate_name, term1_name, term2_name, negated)
+        if key in atomic_table:
+            return atomic_table[key]
+
         term1 = parse_term(term1_name)
         term2 = parse_term(term2_name)
         if predicate_name.isnumeric():
@@ -127,4 +144,6 @@ def parse_lstr_to_lformula(lstr: str) -> Formula:
             predicate = Atomic(relation=predicate_name,
                                         head=term1,
                                         tail=term2)
+        predicate.negated = negated
+        atomic_table[key] = predicate
         return predicate
@@ -59,7 +59,7 @@ class BEAMReasoner(Reasoner):
         if self.bfs_var_name_levels:
             var_name_list = self.bfs_var_name_levels.pop(-1)
             for var_name in var_name_list:
-                for atomic_name in self.formula.term_name2atomic_name_list[var_name]:
+                for atomic_name in self.formula.term_name2atomic_name_list.get(var_name, ()):
                     counter = 0
                     # head, tail = self.formula.atomic_dict[atomic_name].get_terms():
                     # if head
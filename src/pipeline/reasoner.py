@@ -12,6 +12,8 @@ from src.language.foq import (Atomic, Conjunction, Disjunction,
 class Reasoner:
     formula: EFO1Query = None
     term_local_emb_dict = {}
+    # validate the grounded lists before each evaluation, set by --debug
+    debug = False
 
     @abstractmethod
     def initialize_with_query(self, formula:EFO1Query):
@@ -82,6 +84,9 @@ class Reasoner:
 
             return torch.cat(collect, dim=-1)
 
+        if self.debug:
+            self.formula.validate_num_instances()
+
         if batch_size_eval:
             return run_in_batch(batch_size=batch_size_eval)
         else:
@@ -86,19 +86,20 @@ class RaggedBatch:
 
 
 class QAACollator:
-    def __init__(self, lstr):
+    def __init__(self, lstr, answer_tensor=False):
         self.lstr = lstr
+        self.answer_tensor = answer_tensor
 
     def __call__(self, batch_input):
         lformula = parse_lstr_to_lformula(self.lstr)
-        query = EFO1Query(lformula)
-        for rsdict, easy_ans, hard_ans in batch_input:
-            query.append_qa_instances(rsdict, easy_ans, hard_ans)
+        query = EFO1Query(lformula, answer_tensor=self.answer_tensor)
+        query.reserve(len(batch_input))
+        query.extend_qa_instances(batch_input)
         return query
 
 
 class QueryAnsweringSeqDataLoader:
-    def __init__(self, qaafile, target_lstr=None, size_limit=-1, **dataloader_kwargs) -> None:
+    def __init__(self, qaafile, target_lstr=None, size_limit=-1, answer_tensor=False, **dataloader_kwargs) -> None:
         self.dataloader_kwargs = dataloader_kwargs
 
         with open(qaafile, 'rt') as f:
@@ -120,7 +121,7 @@ class QueryAnsweringSeqDataLoader:
 
             print(f"query {_lstr} of size {len(qaa)} loaded from {qaafile}")
             self.lstr_iterator[_lstr] = DataLoader(qaa,
-                collate_fn=QAACollator(_lstr),
+                collate_fn=QAACollator(_lstr, answer_tensor),
                 **self.dataloader_kwargs)
 
 
@@ -86,6 +86,7 @@ parser.add_argument("--checkpoint_path_gnn", type=str, default=None)
 parser.add_argument("--seed", default=0, type=int, help="random seed")
 parser.add_argument('--freeze_nlp', action='store_true', default=False, help='Whether to freeze the pre-trained neural link predictor.')
 parser.add_argument('--pre_norm', action='store_true', default=False, help='Whether to use pre norm.')
+parser.add_argument('--debug', action='store_true', default=False, help='Whether to validate the grounded lists of each query before evaluation.')
 
 
 def train_gnn(
@@ -172,18 +173,35 @@ def train_gnn(
 
 def compute_evaluation_scores(fof, batch_entity_rankings, metric):
     k = 'f'
+
+    if fof.answer_tensor_dict is not None:
+        def has_answers(kind, i):
+            return fof.has_answer_tensor(kind, i, k)
+
+        def get_answers(kind, i):
+            # the int64 view is only moved to the device
+            return fof.get_answer_tensor(kind, i, k).to(nbp.device)
+    else:
+        answer_lists = {'easy': fof.easy_answer_list,
+                        'hard': fof.hard_answer_list}
+
+        def has_answers(kind, i):
+            answers = answer_lists[kind][i]
+            return bool(answers) and bool(answers[k])
+
+        def get_answers(kind, i):
+            return torch.tensor(answer_lists[kind][i][k], device=nbp.device)
+
     for i, ranking in enumerate(torch.split(batch_entity_rankings, 1)):
         ranking = ranking.squeeze()
-        if fof.hard_answer_list[i]:
+        if has_answers('hard', i):
             # [1, num_entities]
-            hard_answers = torch.tensor(fof.hard_answer_list[i][k],
-                                        device=nbp.device)
+            hard_answers = get_answers('hard', i)
             hard_answer_rank = ranking[hard_answers]
 
             # remove better easy answers from its rankings
-            if fof.easy_answer_list[i][k]:
-                easy_answers = torch.tensor(fof.easy_answer_list[i][k],
-                                            device=nbp.device)
+            if has_answers('easy', i):
+                easy_answers = get_answers('easy', i)
                 easy_answer_rank = ranking[easy_answers].view(-1, 1)
 
                 num_skipped_answers = torch.sum(
@@ -194,7 +212,7 @@ def compute_evaluation_scores(fof, batch_entity_rankings, metric):
 
         else:
             pure_hard_ans_rank = ranking[
-                torch.tensor(fof.easy_answer_list[i][k], device=nbp.device)]
+                get_answers('easy', i)]
 
         # remove better hard answers from its ranking
         _reference_hard_ans_rank = pure_hard_ans_rank.reshape(-1, 1)
@@ -406,6 +424,7 @@ if __name__ == "__main__":
     # * parse argument
     args = parser.parse_args()
     set_global_seed(args.seed)
+    Reasoner.debug = args.debug
 
     # * prepare the logger
     os.makedirs(args.output_dir, exist_ok=True)
@@ -451,6 +470,7 @@ if __name__ == "__main__":
     valid_dataloader = QueryAnsweringSeqDataLoader(
         osp.join(args.task_folder, 'valid-qaa.json'),
         target_lstr=eval_queries,
+        answer_tensor=True,
         batch_size=args.batch_size_eval_dataloader,
         shuffle=False,
         num_workers=0)
@@ -458,6 +478,7 @@ if __name__ == "__main__":
     test_dataloader = QueryAnsweringSeqDataLoader(
         osp.join(args.task_folder, 'test-qaa.json'),
         target_lstr=eval_queries,
+        answer_tensor=True,
         batch_size=args.batch_size_eval_dataloader,
         shuffle=False,
         num_workers=0)